@@ -9,131 +9,671 @@ ref, see
 https://charlesleifer.com/blog/going-fast-with-sqlite-and-python/
 """
 
+import logging
+import pickle
 import sqlite3
-from threading import Thread, get_ident, Lock
-from queue import Queue
-from multiprocessing import Process, Manager
-from enum import Enum
-from time import time
-from typing import Union
+from ctypes import c_longlong
+from threading import Thread, get_ident, Lock, local
+from weakref import WeakValueDictionary
+from queue import Empty
+try:
+    from queue import SimpleQueue
+except ImportError:
+    # Python 3.6: same interface, slower
+    from queue import Queue as SimpleQueue
+from multiprocessing import get_context
+from multiprocessing.queues import SimpleQueue as PipeQueue
+try:
+    from multiprocessing.shared_memory import SharedMemory
+except ImportError:
+    # Python < 3.8: everything goes through the pipes
+    SharedMemory = None
+from typing import Union, Any, Tuple, Iterable
+from itertools import cycle, repeat
+from time import perf_counter, sleep
+from urllib.parse import quote
 
 
-# When a queue is that old and empty, delete it
-OLD_QUEUE_TRIGGER = 60 * 5
+log = logging.getLogger("sqlitemulti")
 
+# Max number of queued commands a worker runs - and commits at once - per wakeup
+MAX_BATCH = 64
 
-class SqlCommand(Enum):
-    EXECUTE = 1
-    EXECUTEMANY = 2
-    INSERT = 3
-    INSERTMANY = 4  # not used yet
-    DELETE = 5
-    DELETEMANY = 6  # not used yet
-    FETCHONE = 7
-    FETCHALL = 8
-    COMMIT = 9
-    STOP = 10
+# Max time a worker keeps adding commands to a batch, in seconds. Bounds the wait of the first command's caller.
+MAX_BATCH_DELAY = 0.005
+
+# Size of the prepared statements cache of each worker connection (sqlite3 default is 128)
+CACHED_STATEMENTS = 512
+
+# Process mode: bulk params with at least that many rows go through shared memory instead of the command pipe.
+# Python 3.8+, older ones always use the pipe.
+SHARED_MEMORY_ROWS = 10000
+
+# Max delay between two retries of a command that failed with SQLITE_BUSY, in seconds. Starts at 1 ms, doubles.
+MAX_BUSY_DELAY = 0.1
+
+# Process mode: max number of distinct sql sent once, then by handle, per worker. Others are sent in full each time.
+MAX_INTERNED_SQL = 1024
+
+# Applied by each worker right after connect, along with journal_mode and synchronous.
+DEFAULT_PRAGMAS = {
+    "temp_store": "MEMORY",
+    "mmap_size": 10 * 1024 * 1024 * 1024,  # 10 GiB, SQLite caps it to its own compile time max
+    "cache_size": -65536,  # 64 MiB
+}
+
+
+# Commands travel to the workers as plain tuples:
+#   (result_queue, command, sql, params, commit)
+# result_queue is None when no answer is expected, or the client thread id for a worker Process.
+# params is never None: the client sends () instead, so handlers call execute(sql, params) with no branch.
+# A tuple literal is the cheapest to build, unpack and pickle - a namedtuple costs several times more per message.
+# Queues carry no task_done()/join() accounting: callers sync on their answer, or on flush().
+
+# Sql commands. Plain ints: compared and hashed in C, no Enum machinery on the hot path.
+EXECUTE = 1
+EXECUTEMANY = 2
+INSERT = 3
+INSERTMANY = 4
+DELETE = 5
+DELETEMANY = 6  # not used yet
+FETCHONE = 7
+FETCHALL = 8
+COMMIT = 9
+STOP = 10
+PIPELINE = 11
+REGISTER_SQL = 12  # Process mode: (None, REGISTER_SQL, sql, handle, False), next commands carry the int handle as sql
+TRANSACTION = 13
+
+
+class _SharedPayload:
+    """A pickled object in a shared memory block. Crosses the pipes instead of the object itself.
+    Read once: load() frees the block."""
+
+    __slots__ = ("name", "size")
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+    @classmethod
+    def dump(cls, obj) -> "_SharedPayload":
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        shm = SharedMemory(create=True, size=len(data))
+        shm.buf[: len(data)] = data
+        shm.close()  # The block itself lives on until unlink()
+        return cls(shm.name, len(data))
+
+    def load(self):
+        shm = SharedMemory(self.name)
+        try:
+            buf = shm.buf[: self.size]
+            obj = pickle.loads(buf)
+            buf.release()
+        finally:
+            shm.close()
+            shm.unlink()
+        return obj
+
+
+class _ProcessQueue(PipeQueue):
+    """Command queue of worker Processes. put() pickles in the calling thread: a message that can't be pickled
+    raises there, rather than being dropped by a feeder thread while its caller waits forever for the answer.
+    No feeder thread either: once the pipe is full, put() waits for the worker to catch up.
+
+    qsize() is counted: messages put, by the client, minus messages taken, reported by the workers.
+    sem_getvalue(), that multiprocessing.Queue.qsize() relies on, is not implemented on every platform."""
+
+    def __init__(self, *, ctx):
+        super().__init__(ctx=ctx)
+        self._put_count = 0
+        self._put_lock = Lock()
+        self._taken = ctx.Value(c_longlong, 0)  # Shared with the workers. Not "q": Python 3.6 has no such typecode.
+        self.workers = 0  # Worker Processes taking from it, alive as far as their routers know
+        self.dead = False  # No worker left: whatever is put won't be answered
+
+    def __getstate__(self):
+        # The workers only need the taken counter
+        return super().__getstate__() + (self._taken,)
+
+    def __setstate__(self, state):
+        super().__setstate__(state[:-1])
+        self._taken = state[-1]
+
+    def put(self, obj) -> None:
+        super().put(obj)
+        with self._put_lock:
+            self._put_count += 1
+
+    def taken(self, count: int) -> None:
+        """Worker side: count messages were taken from the queue"""
+        with self._taken.get_lock():
+            self._taken.value += count
+
+    def qsize(self) -> int:
+        return self._put_count - self._taken.value
+
+    def close(self) -> None:
+        """Frees both ends of the pipe. Not inherited: multiprocessing SimpleQueue only has it from Python 3.9."""
+        self._reader.close()
+        self._writer.close()
+
+    def get_nowait(self):
+        """Single consumer only: another one could take the message between empty() and get()."""
+        if self.empty():
+            raise Empty
+        return self.get()
+
+
+class _ResultQueue(SimpleQueue):
+    """Result queue of a client thread.
+    pending: how many answers that thread waits for. Only its own thread writes it, no lock needed
+    - but for routers of dead worker Processes, that answer in its place under _result_queues_lock.
+    waiting_on: the command queue it waits on, or None for all of them."""
+
+    __slots__ = ("pending", "waiting_on")
+
+    def __init__(self):
+        super().__init__()
+        self.pending = 0
+        self.waiting_on = None
+
+
+def _verbose_logging() -> None:
+    """verbose=True: shows our debug messages, even if the app did not configure logging."""
+    log.setLevel(logging.DEBUG)
+    if not log.hasHandlers():
+        log.addHandler(logging.StreamHandler())
+
+
+def _send_reply(reply_pipe, key, res) -> None:
+    """Worker Process side of an answer. Big fetchall results go through shared memory, only their name through the pipe."""
+    if type(res) is list and len(res) >= SHARED_MEMORY_ROWS and SharedMemory is not None:
+        res = _SharedPayload.dump(res)
+    try:
+        reply_pipe.send((key, res))
+    except Exception as e:
+        # Could not be pickled - some exceptions can't. The caller still needs an answer, or would wait forever.
+        reply_pipe.send((key, RuntimeError(f"Unpicklable answer {res!r}: {e}")))
+
+
+def _answer_error(queue, reply_pipe, error: Exception) -> None:
+    """Loop of a worker that could not open its db: answers every command with that error, until STOP."""
+    while True:
+        result_queue, command, sql, params, commit = queue.get()
+        if reply_pipe is not None:
+            queue.taken(1)
+        if command == STOP:
+            if reply_pipe is not None:
+                reply_pipe.send((None, None))
+            return
+        if type(params) is _SharedPayload:
+            # Frees the block
+            params.load()
+        elif command == PIPELINE:
+            for op, op_sql, op_params in params:
+                if type(op_params) is _SharedPayload:
+                    op_params.load()
+        if result_queue:
+            if reply_pipe is None:
+                result_queue.put(error)
+            else:
+                _send_reply(reply_pipe, result_queue, error)
+
+
+def _is_busy(e: Exception) -> bool:
+    """SQLITE_BUSY: another connection holds the lock"""
+    return type(e) is sqlite3.OperationalError and str(e) == "database is locked"
+
+
+def _retry_busy(handler, cur, sql, params, error: Exception, deadline: float) -> Tuple[Any, bool]:
+    """Runs handler again, with exponential backoff, while it fails with SQLITE_BUSY, until the deadline.
+    A statement only gets SQLITE_BUSY while the connection does not hold the write lock: its open transaction,
+    if any, has nothing written yet. Rolling it back first loses nothing, and drops a WAL snapshot that went stale
+    - SQLITE_BUSY_SNAPSHOT, that sqlite3's busy handler does not wait on and that no retry in the same transaction clears.
+    Raises the last error once the deadline is over."""
+    db = cur.connection
+    delay = 0.001
+    while perf_counter() + delay <= deadline:
+        if db.in_transaction:
+            db.rollback()
+        sleep(delay)
+        try:
+            return handler(cur, sql, params)
+        except sqlite3.OperationalError as e:
+            if not _is_busy(e):
+                raise
+            error = e
+        delay = min(delay * 2, MAX_BUSY_DELAY)
+    raise error
+
+
+def _h_execute(cur, sql, params) -> Tuple[Any, bool]:
+    """EXECUTE, INSERT and DELETE. A list of sql is a transaction."""
+    if type(sql) is list:
+        return _h_transaction(cur, sql, params)
+    cur.execute(sql, params)
+    # TODO: send inserted or deleted count back
+    return True, False
+
+
+def _run_transaction(cur, sql: list, params: list) -> None:
+    """Runs and commits the list of sql, each with its params. Rolls back and raises on any error."""
+    if type(params) is not list:
+        raise ValueError("Params has to be a list, too")
+    db = cur.connection
+    if db.in_transaction:
+        # Commit previous commands of the batch first, so a rollback here can't undo them.
+        db.commit()
+    try:
+        if all(not line_params for line_params in params):
+            # No params at all: a single script, parsed and run in one call.
+            # Separators on their own line, so a trailing -- comment can't swallow them.
+            cur.executescript("BEGIN IMMEDIATE;\n" + "\n;\n".join(sql) + "\n;\nCOMMIT;")
+        else:
+            # Explicit transaction: writer lock is taken once, for the whole list.
+            cur.execute("BEGIN IMMEDIATE")
+            for i, sql_line in enumerate(sql):
+                cur.execute(sql_line, params[i])
+            db.commit()
+    except Exception as e:
+        log.warning("Transaction rolled back: %s", e)
+        db.rollback()
+        raise
+
+
+def _h_transaction(cur, sql: list, params: list) -> Tuple[Any, bool]:
+    # We have a transaction - sql as well as params are lists
+    try:
+        _run_transaction(cur, sql, params)
+    except Exception:
+        return False, False
+    #  TODO: returns proper info depending on request.
+    return len(sql), False  # returns len of sql. Already committed.
+
+
+def _h_transaction_command(cur, sql: list, params: list) -> Tuple[Any, bool]:
+    """TRANSACTION: sends None back once committed. On error, it is rolled back and the worker sends the exception."""
+    _run_transaction(cur, sql, params)
+    return None, False
+
+
+def _h_pipeline(cur, sql, params: list) -> Tuple[Any, bool]:
+    """Runs a list of (command, sql, params) in a single transaction, sends the list of their results back."""
+    # Loaded - and their blocks freed - first, even if the transaction does not get to them.
+    params = [
+        (command, op_sql, op_params.load() if type(op_params) is _SharedPayload else op_params)
+        for command, op_sql, op_params in params
+    ]
+    db = cur.connection
+    if db.in_transaction:
+        # Commit previous commands of the batch first, so a rollback here can't undo them.
+        db.commit()
+    results = []
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        for command, op_sql, op_params in params:
+            results.append(HANDLERS[command](cur, op_sql, op_params)[0])
+        db.commit()
+    except Exception as e:
+        log.warning("Pipeline rolled back: %s", e)
+        db.rollback()
+        return False, False
+    return results, False
+
+
+def _h_executemany(cur, sql, params) -> Tuple[Any, bool]:
+    """EXECUTEMANY and INSERTMANY: one statement, many params, one commit. Sends the row count back."""
+    cur.executemany(sql, params)
+    return cur.rowcount, True
+
+
+def _h_fetchone(cur, sql, params) -> Tuple[Any, bool]:
+    return cur.execute(sql, params).fetchone(), False
+
+
+def _h_fetchall(cur, sql, params) -> Tuple[Any, bool]:
+    return cur.execute(sql, params).fetchall(), False
+
+
+def _h_commit(cur, sql, params) -> Tuple[Any, bool]:
+    return None, True
+
+
+# All a read only worker accepts
+READ_COMMANDS = frozenset((FETCHONE, FETCHALL, COMMIT))
+
+# Need write access, not applied by read only workers
+WRITE_PRAGMAS = ("journal_mode",)
+
+# Worker dispatch: command -> handler(cursor, sql, params), returning (result, force commit).
+# STOP is handled by the worker loop itself.
+HANDLERS = {
+    EXECUTE: _h_execute,
+    EXECUTEMANY: _h_executemany,
+    INSERT: _h_execute,
+    INSERTMANY: _h_executemany,
+    DELETE: _h_execute,
+    FETCHONE: _h_fetchone,
+    FETCHALL: _h_fetchall,
+    COMMIT: _h_commit,
+    PIPELINE: _h_pipeline,
+    TRANSACTION: _h_transaction_command,
+}
 
 
 def sqlite_worker(
-    queue, database, timeout=5, isolation_level="", uri=None, verbose: bool = False
+    queue,
+    database,
+    timeout=5,
+    isolation_level="",
+    uri=None,
+    verbose: bool = False,
+    max_batch: int = MAX_BATCH,
+    reply_pipe=None,
+    pragmas: Union[None, dict] = None,
+    max_batch_delay: float = MAX_BATCH_DELAY,
 ):
-    """Worker, running in thread or Process"""
+    """Worker, running in thread or Process
+
+    Every wakeup runs pending commands - up to max_batch of them, for max_batch_delay seconds at most -
+    commits once for the whole batch and only then sends the answers back.
+    In a Process, result queues can't travel through the command queue: commands then carry a key instead,
+    and answers are sent as (key, res) on the worker's own reply_pipe."""
+    if verbose:
+        # Needed in a worker Process, it does not inherit our logging config.
+        _verbose_logging()
+    # Evaluated once: no message is built in the loop unless debug is on.
+    debug = log.isEnabledFor(logging.DEBUG)
     try:
-        # print("isolation", isolation_level)
         db = sqlite3.connect(
             database,
             timeout=timeout,
             isolation_level=isolation_level,
             uri=uri,
             check_same_thread=False,  # We will not need this, but I suppose this could save some tests/time.
+            cached_statements=CACHED_STATEMENTS,
         )
+        if pragmas:
+            for name, value in pragmas.items():
+                pragma = f"PRAGMA {name}={value}"
+                try:
+                    db.execute(pragma)
+                except sqlite3.OperationalError as e:
+                    if not _is_busy(e):
+                        raise
+                    # Another worker switching the same new db to WAL: SQLite does not call the busy handler for that.
+                    _retry_busy(_h_execute, db.cursor(), pragma, (), e, perf_counter() + timeout)
     except Exception as e:
-        if verbose:
-            print(f"DB Process error at connect {e}")
-        raise
-    if verbose:
-        print(f"DB Queue {database} started")
+        log.error("DB Process error at connect %s", e)
+        _answer_error(queue, reply_pipe, e)
+        return
+    # A single cursor for all the commands of this worker
+    cur = db.cursor()
+    if debug:
+        log.debug("DB Queue %s started", database)
+    # Hot loop: attributes and the dispatch table are resolved once, as locals.
+    get = queue.get
+    get_nowait = queue.get_nowait
+    sql_table = {}  # handle: sql, from REGISTER_SQL
+
+    def _h_register_sql(cur, sql, handle) -> Tuple[Any, bool]:
+        sql_table[handle] = sql
+        return None, False
+
+    # This worker's own dispatch table: the shared one, plus the handlers that need its state.
+    handlers = {**HANDLERS, REGISTER_SQL: _h_register_sql}
     while True:
-        try:
-            result_queue, command, sql, params, commit = queue.get(
-                block=True, timeout=30
-            )
-            if verbose:
-                print(f"DB Queue got {command}:{sql} {params}")
-            res = None
-            if command in (SqlCommand.EXECUTE, SqlCommand.INSERT, SqlCommand.DELETE):
-                if type(sql) is list:
-                    # We have a transaction - sql as well as params are lists
-                    if type(params) is not list:
-                        raise ValueError("Params has to be a list, too")
-                    try:
-                        for i, sql_line in enumerate(sql):
-                            db.execute(sql_line, params[i])
-                        commit = True  # Force commit since all went fine.
-                        #  TODO: returns proper info depending on request.
-                        res = len(sql)  # returns len of sql
-                    except Exception as e:
-                        print(f"Exception {e}")
-                        db.rollback()
-                        res = False
+        # Blocks with no timeout: no periodic wakeups while idle. STOP is what ends the loop.
+        item = get()
+        # Batch is committed, and answered, once max_batch commands ran, max_batch_delay elapsed,
+        # or nothing is pending anymore. Commands that arrive meanwhile join the batch.
+        started = perf_counter()
+        deadline = started + max_batch_delay
+        count = 0
+        replies = []  # (result_queue, res) of the commands awaiting an answer, only sent once the batch is committed
+        must_commit = False
+        stopping = False
+        while True:
+            result_queue, command, sql, params, commit = item
+            count += 1
+            # Uncommitted writes of earlier commands of the batch, if any
+            in_transaction = db.in_transaction
+            try:
+                if debug:
+                    log.debug("DB Queue got %s:%s %s", command, sql, params)
+                if command == STOP:
+                    if debug:
+                        log.debug("DB Process stopping")
+                    stopping = True
+                    break
+                if type(sql) is int:
+                    sql = sql_table[sql]
+                if type(params) is _SharedPayload:
+                    # Loaded - and its block freed - once, even if the command is retried.
+                    params = params.load()
+                try:
+                    res, force_commit = handlers[command](cur, sql, params)
+                except sqlite3.OperationalError as e:
+                    if not _is_busy(e):
+                        raise
+                    # The busy handler may already have waited: the whole batch waits timeout at most.
+                    res, force_commit = _retry_busy(handlers[command], cur, sql, params, e, started + timeout)
+                if commit or force_commit:
+                    must_commit = True
+                if result_queue:
+                    replies.append((result_queue, res))
+            except Exception as e:
+                if in_transaction and not db.in_transaction and command != TRANSACTION:
+                    # That error rolled the whole transaction back - INSERT OR ROLLBACK, RAISE(ROLLBACK), SQLITE_FULL...
+                    # Earlier commands of the batch are undone: their callers get the error, too.
+                    # TRANSACTION is not concerned, it committed them before its own BEGIN.
+                    log.warning("DB Process running %s:%s %s, batch rolled back", command, sql, e)
+                    replies = [(result_queue, e) for result_queue, res in replies]
+                # The caller gets the exception as its answer, and raises it.
+                if result_queue:
+                    replies.append((result_queue, e))
                 else:
-                    db.execute(sql, params)
-                    res = True
-                    if command == SqlCommand.INSERT:
-                        # TODO: send inserted count back
-                        pass
-                    elif command == SqlCommand.DELETE:
-                        # TODO: sends deleted back
-                        pass
-            elif command == SqlCommand.EXECUTEMANY:
-                # Execute and sends the value back
-                db.executemany(sql, params)
-                commit = True
-                res = True
-
-            elif command == SqlCommand.FETCHONE:
-                # Execute and sends the value back
-                result = db.execute(sql, params)
-                res = result.fetchone()
-            elif command == SqlCommand.FETCHALL:
-                # Execute and sends the value back
-                result = db.execute(sql, params)
-                res = result.fetchall()
-            elif command == SqlCommand.COMMIT:
-                db.commit()
-            elif command == SqlCommand.STOP:
-                if verbose:
-                    print("DB Process stopping")
-                return
-            else:
-                raise ValueError("Unknown SqlCommand")
-            if commit:
+                    # Nobody waits for this one: the log is all that is left of it.
+                    log.warning("DB Process running %s:%s %s", command, sql, e)
+            if count >= max_batch or perf_counter() > deadline:
+                break
+            try:
+                item = get_nowait()
+            except Empty:
+                break
+        if debug:
+            log.debug("DB Queue ran a batch of %s", count)
+        if reply_pipe is not None:
+            # For the client's status()
+            queue.taken(count)
+        try:
+            if must_commit:
+                # A single commit - and fsync - for the whole batch
                 db.commit()
-            # Send the data back to the provided queue
-            if result_queue:
+        except Exception as e:
+            log.warning("DB Process commit %s, batch rolled back", e)
+            db.rollback()
+            # Nothing of this batch is committed: every caller gets the error.
+            replies = [(result_queue, e) for result_queue, res in replies]
+        # Send the data back to the provided queues
+        for result_queue, res in replies:
+            if reply_pipe is None:
                 result_queue.put(res)
-            queue.task_done()
+            else:
+                _send_reply(reply_pipe, result_queue, res)
+        # Do not keep the callers' result queues alive while waiting for the next batch.
+        item = replies = result_queue = res = None
+        if stopping:
+            # Clean close, so WAL mode checkpoints and removes its -wal and -shm files
+            db.close()
+            if reply_pipe is not None:
+                # Tells the client side router to end, too.
+                reply_pipe.send((None, None))
+            return
+
+
+def _in_memory(database: str, uri: Union[None, bool]) -> bool:
+    """True for a ":memory:" db, or its URI forms"""
+    if database == ":memory:":
+        return True
+    return bool(uri) and (database.startswith("file::memory:") or "mode=memory" in database)
+
+
+def _read_only_uri(database: str, uri: Union[None, bool]) -> str:
+    """URI that opens database read only"""
+    if not uri:
+        database = "file:" + quote(database)
+    separator = "&" if "?" in database else "?"
+    return f"{database}{separator}mode=ro"
+
+
+def sqlite_read_worker(
+    queue,
+    database,
+    timeout=5,
+    isolation_level="",
+    uri=None,
+    verbose: bool = False,
+    max_batch: int = MAX_BATCH,
+    reply_pipe=None,
+    pragmas: Union[None, dict] = None,
+):
+    """Read only worker, same signature as sqlite_worker. isolation_level and max_batch are not used.
+
+    Thin loop specialized for FETCHONE and FETCHALL: no batch, no commit, no dispatch table.
+    The connection is opened read only: in WAL mode, any number of them can read along the writer."""
+    if verbose:
+        _verbose_logging()
+    debug = log.isEnabledFor(logging.DEBUG)
+    try:
+        # Can't create the db: fails if it does not exist yet.
+        db = sqlite3.connect(
+            _read_only_uri(database, uri),
+            timeout=timeout,
+            isolation_level=None,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=CACHED_STATEMENTS,
+        )
+        if pragmas:
+            for name, value in pragmas.items():
+                if name not in WRITE_PRAGMAS:
+                    db.execute(f"PRAGMA {name}={value}")
+    except Exception as e:
+        log.error("DB Read Process error at connect %s", e)
+        _answer_error(queue, reply_pipe, e)
+        return
+    cur = db.cursor()
+    if debug:
+        log.debug("DB Read Queue %s started", database)
+    get = queue.get
+    while True:
+        result_queue, command, sql, params, commit = get()
+        if reply_pipe is not None:
+            queue.taken(1)
+        if command == STOP:
+            db.close()
+            if reply_pipe is not None:
+                reply_pipe.send((None, None))
+            return
+        try:
+            if command == FETCHONE:
+                res = cur.execute(sql, params).fetchone()
+            elif command == FETCHALL:
+                res = cur.execute(sql, params).fetchall()
+            else:
+                # COMMIT, from flush(): nothing to commit.
+                res = None
         except Exception as e:
-            if verbose:
-                print(f"DB Process running {e}")
+            res = e
+            if not result_queue:
+                log.warning("DB Read Process running %s:%s %s", command, sql, e)
+        if result_queue:
+            if reply_pipe is None:
+                result_queue.put(res)
+            else:
+                _send_reply(reply_pipe, result_queue, res)
+        result_queue = None
+
+
+class Pipeline:
+    """Accumulates commands locally, and sends them all in a single message when the with block ends.
+    The worker runs them in a single transaction. Once out of the block, results holds the list of their results,
+    or False if the transaction was rolled back. Nothing is sent if the block raised."""
+
+    __slots__ = ("_parent", "_ops", "results")
+
+    def __init__(self, parent: "SqliteMulti"):
+        self._parent = parent
+        self._ops = []
+        self.results = None
+
+    def __enter__(self) -> "Pipeline":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None and self._ops:
+            self.results = self._parent._execute(PIPELINE, "", self._ops, commit=True, bulk=True)
+        self._ops = []
+
+    def _add(self, command: int, sql: str, params) -> None:
+        if type(sql) is not str:
+            # A list of sql runs as a transaction of its own, that would commit the ops before it mid pipeline.
+            raise TypeError(f"Pipeline sql has to be a str, not {type(sql).__name__}")
+        self._ops.append((command, sql, params))
+
+    def execute(self, sql: str, params: Union[None, tuple] = None) -> None:
+        self._add(EXECUTE, sql, params or ())
+
+    def executemany(self, sql: str, params: Iterable) -> None:
+        # Process mode: goes through _bulk_params() once sent, like SqliteMulti.executemany().
+        self._add(EXECUTEMANY, sql, params)
+
+    def fetchall(self, sql: str, params: Union[None, tuple] = None) -> None:
+        self._add(FETCHALL, sql, params or ())
+
+    def fetchone(self, sql: str, params: Union[None, tuple] = None) -> None:
+        self._add(FETCHONE, sql, params or ())
+
+    def insert(self, sql: str, params: Union[None, tuple] = None) -> None:
+        self._add(INSERT, sql, params or ())
+
+    def delete(self, sql: str, params: Union[None, tuple] = None) -> None:
+        self._add(DELETE, sql, params or ())
 
 
 class SqliteMulti:
-    """Tries to mimic sqlite3 interface as much as possible but add some convenient params"""
+    """Tries to mimic sqlite3 interface as much as possible but add some convenient params
+
+    Each worker applies PRAGMAs right after connect:
+    journal_mode (WAL) and synchronous (NORMAL), from their own params,
+    then DEFAULT_PRAGMAS: cache_size -65536 (64 MiB of page cache), temp_store MEMORY (no sorts spilled to disk),
+    mmap_size 10 GiB (db pages are read through the kernel page cache, no copy).
+    The pragmas param is a {name: value} dict that overrides any of them, or adds others.
+    busy_timeout is not in there: it comes from the timeout param, as in sqlite3.
+    """
 
     __slots__ = (
         "_command_queues",
+        "_ctx",
+        "_dispatch",
+        "_read_dispatch",
+        "_read_queue",
+        "_readers",
+        "_round_robin",
         "_own_process",
+        "_read_only",
         "_result_queues",
+        "_routers",
         "_workers",
         "_verbose",
         "_stopping",
         "_tasks",
-        "_current_queue",
-        "_lock",
         "_result_queues_lock",
-        "_trigger_garbage_collector"
+        "_tls",
+        "_sql_interns",
+        "_sql_lock",
     )
 
     def __init__(
@@ -145,71 +685,166 @@ class SqliteMulti:
         own_process=False,
         verbose: bool = False,
         tasks: int = 1,
+        max_batch: int = MAX_BATCH,
+        pragmas: Union[None, dict] = None,
+        dispatch: str = "rr",
+        read_only: bool = False,
+        readers: int = 0,
+        journal_mode: Union[None, str] = "WAL",
+        synchronous: Union[None, str] = "NORMAL",
     ):
+        if dispatch not in ("rr", "sticky"):
+            raise ValueError(f"Unknown dispatch {dispatch}, 'rr' or 'sticky' expected")
         if tasks < 1:
             tasks = 1
-        self._result_queues = dict()
+        if max_batch < 1:
+            max_batch = 1
+        if readers < 0:
+            readers = 0
+        if (readers or read_only) and _in_memory(database, uri):
+            # Each read only connection would open its own, empty, in memory db.
+            raise ValueError("readers and read_only need a db file, not an in memory db")
+        # WAL lets readers run along the writer, and only fsyncs at checkpoints.
+        journal_pragmas = {}
+        if journal_mode and not _in_memory(database, uri):
+            # In memory dbs do not support WAL
+            journal_pragmas["journal_mode"] = journal_mode
+        if synchronous:
+            journal_pragmas["synchronous"] = synchronous
+        # Caller's pragmas override the defaults, name by name.
+        pragmas = {**journal_pragmas, **DEFAULT_PRAGMAS, **(pragmas or {})}
+        # thread id: result queue. For the routers and status, not on the hot path.
+        # Only the thread-local holds a strong ref: the entry goes away by itself when the thread ends.
+        self._result_queues = WeakValueDictionary()
+        self._tls = local()  # Per client thread result queue
         self._own_process = own_process
-        self._verbose = verbose
+        self._read_only = read_only
+        if verbose:
+            _verbose_logging()
+        self._verbose = log.isEnabledFor(logging.DEBUG)
         self._stopping = False
         self._tasks = tasks
-        self._current_queue = 0
-        self._lock = Lock()  # Lock for command queue select
-        self._result_queues_lock = Lock()  # Lock for result Queue cleaning
-        self._trigger_garbage_collector = False
-        if verbose:
-            print("__Init__")
+        self._result_queues_lock = Lock()  # Lock for result queues registration
+        if self._verbose:
+            log.debug("__Init__")
 
+        # "spawn" so the worker processes do not inherit a copy of our threads and locks.
+        self._ctx = get_context("spawn") if own_process else None
         self._workers = []
+        self._routers = []
         self._command_queues = []
+        args = (database, timeout, isolation_level, uri, verbose, max_batch)
+        target = sqlite_read_worker if read_only else sqlite_worker
         for i in range(self._tasks):
-            if own_process:
-                queue = Manager().Queue()
-                worker = Process(
-                    target=sqlite_worker,
-                    args=(queue, database, timeout, isolation_level, uri, verbose),
-                )
-            else:
-                queue = Queue()
-                worker = Thread(
-                    target=sqlite_worker,
-                    args=(queue, database, timeout, isolation_level, uri, verbose),
-                )
-            worker.daemon = False
-            worker.start()
-            self._workers.append(worker)
+            # Plain pipes for Processes, no Manager process in between.
+            # Threads: many producers, one consumer. SimpleQueue is C level, with no condition variables to notify.
+            queue = _ProcessQueue(ctx=self._ctx) if own_process else SimpleQueue()
+            self._start_worker(target, queue, args, pragmas)
             self._command_queues.append(queue)
+        # Process mode: {command queue: {sql: handle}}, so the sql of a command only crosses each pipe once.
+        # Write workers only: a register sent on the shared read queue would only reach one of the readers.
+        self._sql_interns = None
+        self._sql_lock = Lock()
+        if own_process and not read_only:
+            self._sql_interns = {queue: {} for queue in self._command_queues}
+        # Round robin over the command queues. next() on a cycle is atomic under the GIL, no lock needed.
+        self._round_robin = cycle(self._command_queues).__next__
+        # "rr": every command goes to the next worker.
+        # "sticky": each client thread always talks to the same worker, and hits the same statement cache.
+        self._dispatch = self._round_robin if dispatch == "rr" else self._sticky_queue
 
-    def trigger_garbage_collector(self):
-        """Asks the object to run a garbage collector on next _execute() call"""
-        with self._result_queues_lock:
-            self._trigger_garbage_collector = True
+        # Optional pool of read only workers for fetchone/fetchall. They all wait on the same queue:
+        # whichever is free takes the next read, slow and fast queries balance by themselves.
+        # Only counted once started: stop() sends them one STOP each.
+        self._readers = 0
+        self._read_queue = None
+        self._read_dispatch = self._dispatch
+        if readers:
+            # A read only connection can't create the db nor switch it to WAL: wait for a writer to do it first.
+            try:
+                self.commit()
+            except Exception:
+                # The writers could not open the db. Still running, waiting for STOP: the caller has no object to stop them.
+                self.stop()
+                self.join()
+                raise
+            self._read_queue = _ProcessQueue(ctx=self._ctx) if own_process else SimpleQueue()
+            for i in range(readers):
+                self._start_worker(sqlite_read_worker, self._read_queue, args, pragmas)
+            self._readers = readers
+            self._read_dispatch = repeat(self._read_queue).__next__
 
-    def _run_garbage_collector(self):
-        """We suppose we will run the GC often enough that we won't delete queues that could be used."""
-        if self._verbose:
-            print("Experimental GC")
-        now = time()
+    def _start_worker(self, target, queue, args: tuple, pragmas: dict) -> None:
+        """Starts a worker Thread or Process on that command queue"""
+        if self._own_process:
+            # One writer, one reader: a bare one way pipe, no locks. Length prefixed pickles, one read per answer.
+            reply_reader, reply_writer = self._ctx.Pipe(duplex=False)
+            worker = self._ctx.Process(target=target, args=(queue, *args, reply_writer, pragmas))
+            queue.workers += 1
+            router = Thread(target=self._route_replies, args=(reply_reader, queue))
+            router.daemon = True
+            router.start()
+            self._routers.append(router)
+        else:
+            worker = Thread(target=target, args=(queue, *args, None, pragmas))
+        worker.daemon = False
+        worker.start()
+        if self._own_process:
+            # The worker has its own copy now. Without ours, the router gets EOF if the worker dies.
+            reply_writer.close()
+        self._workers.append(worker)
+
+    def _sticky_queue(self):
+        """Command queue of the current thread. Picked round robin on first call, then kept."""
+        try:
+            return self._tls.command_queue
+        except AttributeError:
+            queue = self._tls.command_queue = self._round_robin()
+            return queue
+
+    def _route_replies(self, reply_pipe, queue) -> None:
+        """Client side of a worker Process: hands every (key, res) answer to the result queue of the calling thread"""
+        while True:
+            try:
+                thread_id, res = reply_pipe.recv()
+            except EOFError:
+                # Worker Process is gone, without a word
+                self._worker_died(queue)
+                thread_id = None
+            if thread_id is None:
+                reply_pipe.close()
+                return
+            if type(res) is _SharedPayload:
+                # Even if nobody waits for it anymore: frees the block.
+                res = res.load()
+            try:
+                self._result_queues[thread_id].put(res)
+            except KeyError:
+                # Thread ended meanwhile, nobody is waiting for that answer.
+                pass
+
+    def _worker_died(self, queue) -> None:
+        """Router side, the worker Process of that command queue died: the threads waiting on it get an error instead.
+        Commands put once it is marked dead are answered by _answer_dead()."""
+        log.error("DB Process died")
         with self._result_queues_lock:
-            to_remove = []
-            for tid, value in self._result_queues.items():
-                if value[1] < now:
-                    # TODO: Check that queue is empty?
-                    # If not, there will be a local reference to that queue somewhere, so it should be ok.
-                    to_remove.append(tid)
-            for tid in to_remove:
-                self._result_queues.pop(tid)
-                if self._verbose:
-                    print(f"Removed Result Queue for Thread {tid}")
-        self._trigger_garbage_collector = False
-
-    def delete_thread_id(self, thread_id: int=0) -> None:
-        """Instead of using the GC, we can explicitly inform the object a thread closed so it can free the related result queue
-        should give better perfs. Can be called from client worker, just before the thread closes."""
-        if thread_id == 0:
-            thread_id = get_ident()
+            queue.workers -= 1
+            if queue.workers:
+                # Read only workers share their queue, the others still answer. Only the read that one ran is lost.
+                return
+            queue.dead = True
+            for result_queue in self._result_queues.values():
+                if result_queue.pending and result_queue.waiting_on in (queue, None):
+                    result_queue.pending -= 1
+                    result_queue.put(RuntimeError("DB worker Process died"))
+
+    def _answer_dead(self, result_queue: _ResultQueue, live: int) -> None:
+        """Client side: commands were just put on dead command queues, live answers are still to come from the others.
+        Their routers may have answered already. Under the lock they are done: the calling thread answers itself for the rest."""
         with self._result_queues_lock:
-            self._result_queues.pop(str(thread_id))
+            for i in range(result_queue.pending - live):
+                result_queue.put(RuntimeError("DB worker Process died"))
+            result_queue.pending = live
 
     @classmethod
     def connect(
@@ -221,97 +856,228 @@ class SqliteMulti:
         own_process=False,
         verbose: bool = False,
         tasks: int = 1,
+        max_batch: int = MAX_BATCH,
+        pragmas: Union[None, dict] = None,
+        dispatch: str = "rr",
+        read_only: bool = False,
+        readers: int = 0,
+        journal_mode: Union[None, str] = "WAL",
+        synchronous: Union[None, str] = "NORMAL",
     ):
         """Alias to __init__, to be alike sqlite3 interface"""
-        return cls(database, timeout, isolation_level, uri, own_process, verbose, tasks)
+        return cls(
+            database,
+            timeout,
+            isolation_level,
+            uri,
+            own_process,
+            verbose,
+            tasks,
+            max_batch,
+            pragmas,
+            dispatch,
+            read_only,
+            readers,
+            journal_mode,
+            synchronous,
+        )
 
     def status(self) -> str:
-        """Returns a status of current queues occupation"""
+        """Returns a status of current queues occupation: commands not taken by a worker yet,
+        and commands waiting for their answer, per client thread"""
         task_type = "Processes" if self._own_process else "Threads"
         status = f"{self._tasks} tasks in {task_type}.\n"
-        try:
-            total = [queue.qsize() for queue in self._command_queues]
-            total = sum(total)
-            status += f"{total} commands\n"
-        except:
-            # Note that this may raise NotImplementedError on Unix platforms like Mac OS X where sem_getvalue() is not implemented.
-            pass
-        status += f"{len(self._result_queues)} result queues\n"
-        try:
-            for id, queue in self._result_queues.items():
-                status += f"  {id}: {queue[0].qsize()}\n"
-        except:
-            pass
+        if self._readers:
+            status += f"{self._readers} read only tasks.\n"
+        # Thread mode: SimpleQueue.qsize(), exact. Process mode: counted by _ProcessQueue, no IPC.
+        queues = self._command_queues + ([self._read_queue] if self._read_queue is not None else [])
+        total = sum(queue.qsize() for queue in queues)
+        status += f"{total} commands queued\n"
+        with self._result_queues_lock:
+            result_queues = list(self._result_queues.items())
+        # Counted by the client threads themselves. Fire-and-forget commands are not, nobody waits for them.
+        total = sum(queue.pending for id, queue in result_queues)
+        status += f"{total} commands awaiting an answer\n"
+        status += f"{len(result_queues)} result queues\n"
+        for id, queue in result_queues:
+            status += f"  {id}: {queue.pending}\n"
         return status
 
     def stop(self):
         """Signal the workers to end"""
         if self._verbose:
-            print("Stop required")
+            log.debug("Stop required")
         self._stopping = True
         for queue in self._command_queues:
-            queue.put((None, SqlCommand.STOP, "", None, False))
+            queue.put((None, STOP, "", None, False))
+        for i in range(self._readers):
+            # Each reader takes one from the shared queue, and ends.
+            self._read_queue.put((None, STOP, "", None, False))
 
     def join(self):
         """Waits until the worker ends nicely. only to be called after a stop(), or will never return"""
         if self._verbose:
-            print("Join required")
+            log.debug("Join required")
         if not self._stopping:
             raise RuntimeError("Join was required, but no stop() before")
         for worker in self._workers:
             worker.join()
+        for router in self._routers:
+            router.join()
+        if self._own_process:
+            # Frees the pipes of the command queues
+            queues = self._command_queues + ([self._read_queue] if self._read_queue is not None else [])
+            for queue in queues:
+                queue.close()
+
+    def _new_result_queue(self) -> _ResultQueue:
+        """First call from the current thread: creates its result queue and registers it."""
+        thread_id = get_ident()
+        if self._verbose:
+            log.debug("New result queue for thread %s", thread_id)
+        # Local queue in both cases: a worker Process answers through its router.
+        # Single producer, single consumer: SimpleQueue is all we need, no unfinished tasks bookkeeping.
+        result_queue = _ResultQueue()
+        with self._result_queues_lock:
+            self._result_queues[thread_id] = result_queue
+        self._tls.result_queue = result_queue
+        # What the commands carry: the queue itself, or the thread id for a worker Process.
+        self._tls.reply_to = thread_id if self._own_process else result_queue
+        return result_queue
+
+    def _bulk_params(self, params: Iterable) -> Union[list, tuple, _SharedPayload]:
+        """Process mode: params of a bulk command, ready to be sent to the worker.
+        Big ones are pickled once, straight into shared memory, and the worker reads them in place."""
+        if not isinstance(params, (list, tuple)):
+            # Has to be pickled to reach the worker Process
+            params = list(params)
+        if len(params) >= SHARED_MEMORY_ROWS and SharedMemory is not None:
+            return _SharedPayload.dump(params)
+        return params
+
+    def _register_sql(self, queue, interns: dict, sql: str) -> Union[int, str]:
+        """Process mode, first time that sql goes to that worker: sends it with a new handle, returns the handle.
+        Once the table is full, returns sql as is."""
+        with self._sql_lock:
+            # Under the lock, so no other thread can send the handle before its register is queued.
+            handle = interns.get(sql)
+            if handle is not None:
+                return handle
+            if len(interns) >= MAX_INTERNED_SQL:
+                return sql
+            handle = len(interns)
+            queue.put((None, REGISTER_SQL, sql, handle, False))
+            # Only visible - and used lock free - once the register is queued.
+            interns[sql] = handle
+        return handle
 
     def _execute(
         self,
-        command: SqlCommand,
+        command: int,
         sql: Union[str, list],
         params: Union[None, tuple, list] = None,
         commit: bool = False,
+        await_result: bool = True,
+        read: bool = False,
+        bulk: bool = False,
     ):
-        """Generic queued command. Enqueues the request, and waits for the answer."""
+        """Generic queued command. Enqueues the request, and waits for the answer.
+        Raises the exception the worker got, if any.
+        With await_result=False, returns None right after enqueuing: the worker sends no answer, errors are logged.
+        read=True sends it to the read only workers, if any. bulk=True: params is a list of params, see _bulk_params().
+        For PIPELINE, bulk=True applies to the params of its EXECUTEMANY ops."""
         if params is None:
             # This is to avoid https://www.thedigitalcatonline.com/blog/2015/02/11/default-arguments-in-python/#default-arguments-evaluation
             # and https://docs.python-guide.org/writing/gotchas/#mutable-default-arguments
-            params = tuple()
-        if self._trigger_garbage_collector:
-            self._run_garbage_collector()
-        thread_id = str(get_ident())
-        if self._verbose:
-            print(f"Called from thread {thread_id}")
-        if thread_id in self._result_queues:
-            result_queue = self._result_queues[thread_id][0]
-        else:
-            if self._own_process:
-                result_queue = Manager().Queue()
-            else:
-                result_queue = Queue()
-            with self._result_queues_lock:
-                # Queue, expiration timestamp
-                self._result_queues[thread_id] = (result_queue, time() + OLD_QUEUE_TRIGGER)
-        # TODO: we should update the timestamp of the result queue to keep it active from GC.
-        # Will systematic calls to time() for every _execute induce significant perfs losses?
-
-        queue_index = self._current_queue  # What command queue to use?
-        if self._tasks > 1:
-            with self._lock:
-                self._current_queue += 1
-                if self._current_queue >= self._tasks:
-                    self._current_queue = 0
-                queue_index = self._current_queue
+            params = ()
+        if self._read_only and command not in READ_COMMANDS:
+            raise ValueError(f"Command {command} on a read only SqliteMulti")
+        queue = self._read_dispatch() if read else self._dispatch()
+        if self._own_process:
+            if queue.dead:
+                # Nobody would take it: the pipe would end up full, and put() would block.
+                raise RuntimeError("DB worker Process died")
+            if bulk:
+                # Only once the command is known to go through: a shared memory block is only freed by the worker.
+                if command == PIPELINE:
+                    params = [
+                        (op, op_sql, self._bulk_params(op_params) if op == EXECUTEMANY else op_params)
+                        for op, op_sql, op_params in params
+                    ]
+                else:
+                    params = self._bulk_params(params)
+        if self._sql_interns is not None and type(sql) is str:
+            interns = self._sql_interns.get(queue)
+            if interns is not None:
+                handle = interns.get(sql)
+                sql = self._register_sql(queue, interns, sql) if handle is None else handle
+        if not await_result:
+            queue.put((None, command, sql, params, commit))
+            return None
+        tls = self._tls
+        try:
+            # Single lookup on the hot path, the queue exists but on first call from a thread.
+            result_queue = tls.result_queue
+        except AttributeError:
+            result_queue = self._new_result_queue()
+
+        # Set first: a router whose worker dies meanwhile answers in its place.
+        result_queue.pending = 1
+        result_queue.waiting_on = queue
         # Enqueue the command
-        self._command_queues[queue_index].put(
-            (result_queue, command, sql, params, commit)
-        )
+        try:
+            queue.put(
+                (tls.reply_to, command, sql, params, commit)
+            )
+        except BaseException:
+            result_queue.pending = 0
+            raise
+        if self._own_process and queue.dead:
+            self._answer_dead(result_queue, 0)
         # And wait for its answer
         if self._verbose:
-            print("Waiting...")
+            log.debug("Waiting...")
         res = result_queue.get()
-        result_queue.task_done()
+        result_queue.pending = 0
+        if isinstance(res, BaseException):
+            raise res
         return res
 
     def commit(self):
         """Signal the worker to commit"""
-        return self._execute(SqlCommand.COMMIT, "")
+        return self._execute(COMMIT, "")
+
+    def flush(self) -> None:
+        """Commits on every worker, and waits until they all did.
+        Allows to pipeline fire-and-forget commands (await_result=False), then sync once."""
+        tls = self._tls
+        try:
+            result_queue = tls.result_queue
+        except AttributeError:
+            result_queue = self._new_result_queue()
+        message = (tls.reply_to, COMMIT, "", (), False)
+        result_queue.pending = len(self._command_queues)
+        result_queue.waiting_on = None
+        for queue in self._command_queues:
+            queue.put(message)
+        if self._own_process:
+            dead = sum(queue.dead for queue in self._command_queues)
+            if dead:
+                self._answer_dead(result_queue, len(self._command_queues) - dead)
+        # Every answer is read before raising: none is left behind in the queue.
+        answers = [result_queue.get() for queue in self._command_queues]
+        result_queue.pending = 0
+        for res in answers:
+            if isinstance(res, BaseException):
+                raise res
+
+    def pipeline(self) -> Pipeline:
+        """Batches commands into a single message and transaction:
+        with db.pipeline() as p:
+            p.insert(sql, params)
+            p.fetchone(sql2)
+        print(p.results)"""
+        return Pipeline(self)
 
     def execute(
         self,
@@ -321,35 +1087,86 @@ class SqliteMulti:
     ):
         """Emulates an execute. Enqueues the request, and waits for the answer.
         If a list of str is sent, they will be considered a transaction"""
-        return self._execute(SqlCommand.EXECUTE, sql, params, commit)
+        return self._execute(EXECUTE, sql, params, commit)
+
+    def transaction(self, sql: list, params: Union[None, list] = None) -> Union[None, Exception]:
+        """Runs the list of sql, each with its params, in a single BEGIN IMMEDIATE ... COMMIT, one message and one fsync.
+        Returns None once committed, or the exception that rolled it back."""
+        if params is None:
+            params = [()] * len(sql)
+        try:
+            return self._execute(TRANSACTION, sql, params, commit=True)
+        except sqlite3.Error as e:
+            return e
+
+    def execute_async(
+        self,
+        sql: Union[str, list],
+        params: Union[None, tuple, list] = None,
+        commit: bool = False,
+    ) -> None:
+        """Fire-and-forget execute: enqueues the request and returns at once, the worker sends no answer.
+        Errors are only logged. commit() - or flush() with several tasks - waits until it ran, and is committed."""
+        self._execute(EXECUTE, sql, params, commit, await_result=False)
 
     def executemany(
-        self, sql: str, params: Union[None, tuple, list] = None, commit: bool = False
+        self,
+        sql: str,
+        params: Union[None, tuple, list] = None,
+        commit: bool = True,
+        await_result: Union[None, bool] = None,
     ):
-        """Emulates an executemany. Single sql, list opf params."""
-        return self._execute(SqlCommand.EXECUTEMANY, sql, params, commit)
+        """Emulates an executemany. Single sql, list of params: a single message and a single commit.
+        Returns the row count. await_result defaults to commit: without commit, does not wait for the answer."""
+        if await_result is None:
+            await_result = commit
+        return self._execute(EXECUTEMANY, sql, params, commit, await_result, bulk=True)
 
     def fetchall(self, sql: str, params: Union[None, tuple] = None):
-        return self._execute(SqlCommand.FETCHALL, sql, params)
+        """Goes to the read only workers if any, they only see committed data."""
+        return self._execute(FETCHALL, sql, params, read=True)
 
     def fetchone(self, sql: str, params: Union[None, tuple] = None):
-        return self._execute(SqlCommand.FETCHONE, sql, params)
+        """Goes to the read only workers if any, they only see committed data."""
+        return self._execute(FETCHONE, sql, params, read=True)
 
     def insert(
         self,
         sql: Union[str, list],
         params: Union[None, tuple, list] = None,
         commit: bool = True,
+        await_result: Union[None, bool] = None,
     ):
         """Emulates an insert. commit is True by default. Enqueues the request, and waits for the answer.
-        If a list of str is sent, they will be considered a transaction"""
-        return self._execute(SqlCommand.INSERT, sql, params, commit)
+        If a list of str is sent, they will be considered a transaction.
+        await_result defaults to commit: without commit, does not wait for the answer, see flush()."""
+        if await_result is None:
+            await_result = commit
+        return self._execute(INSERT, sql, params, commit, await_result)
+
+    def insertmany(
+        self,
+        sql: str,
+        params: Iterable = None,
+        commit: bool = True,
+        await_result: Union[None, bool] = None,
+    ):
+        """Bulk insert: a single message and a single executemany for all the params, one commit.
+        params can be any iterable, a generator keeps memory flat. Returns the inserted row count.
+        await_result defaults to commit: without commit, does not wait for the answer, see flush()."""
+        if await_result is None:
+            await_result = commit
+        return self._execute(INSERTMANY, sql, params, commit, await_result, bulk=True)
 
     def delete(
         self,
         sql: Union[str, list],
         params: Union[None, tuple, list] = None,
         commit: bool = True,
+        await_result: Union[None, bool] = None,
     ):
-        """Emulates a delete. commit is True by default. Enqueues the request, and waits for the answer."""
-        return self._execute(SqlCommand.DELETE, sql, params, commit)
+        """Emulates a delete. commit is True by default. Enqueues the request, and waits for the answer.
+        await_result defaults to commit: without commit, does not wait for the answer, see flush()."""
+        if await_result is None:
+            await_result = commit
+        return self._execute(DELETE, sql, params, commit, await_result)
@@ -6,7 +6,8 @@ import os
 import sys
 import random
 import sqlite3
-import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from time import time, sleep
 
 sys.path.append("../")
@@ -38,7 +39,8 @@ CREATE_INDEX = False  # Set to True to add the index.
 DATA = []
 TOTAL = 0
 
-LOCK = threading.Lock()
+# One slot per read of a run: each thread writes its own, no lock. Summed into TOTAL after each run.
+RESULTS = [0] * THREAD_COUNT
 
 
 def write_data():
@@ -68,9 +70,9 @@ def make_request_data():
     for runs in range(RUN_COUNT):
         run = []
         for lines in range(THREAD_COUNT):
-            # Fake data. index, range
-            line = (random.randint(0, TOTAL_RECORDS - 1), random.randint(0, 10))
-            run.append(line)
+            # Fake data. index, range - stored as the ready to use (start, end) query params.
+            start = random.randint(0, TOTAL_RECORDS - 1)
+            run.append((start, start + random.randint(0, 10)))
         DATA.append(run)
 
 
@@ -79,8 +81,7 @@ def bench_sequential():
     total = 0
     for run in range(RUN_COUNT):
         for line in range(THREAD_COUNT):
-            data = DATA[run][line]
-            res = db.execute(SQL_READ, (data[0], data[0] + data[1]))
+            res = db.execute(SQL_READ, DATA[run][line])
             res = res.fetchone()[0]
             if res is None:
                 res = 0
@@ -89,92 +90,54 @@ def bench_sequential():
 
 
 def sqlite_reader(t_index, db, params):
-    global TOTAL
-    res = db.execute(SQL_READ, (params[0], params[0] + params[1]))
-    res = res.fetchone()[0]
-    with LOCK:
-        if res is None:
-            res = 0
-        TOTAL += res
+    res = db.execute(SQL_READ, params)
+    RESULTS[t_index] = res.fetchone()[0] or 0
 
 
 def bench_threads():
     global TOTAL
     TOTAL = 0
-    # reads from threads, single db handler with check_same_thread=False, minimal Lock
+    # reads from threads, single db handler with check_same_thread=False
     db = sqlite3.connect("benchr.db", check_same_thread=False)
     # No need for journal WAL, no writes here, but you can activate and see no diff.
     # db.execute("PRAGMA journal_mode = WAL")
-    for i in range(RUN_COUNT):
-        threads = []
-        for t in range(THREAD_COUNT):
-            thread = threading.Thread(
-                target=sqlite_reader,
-                args=(t, db, DATA[i][t]),
-            )
-            thread.daemon = True
-            thread.start()
-            threads.append(thread)
-        for t in threads:
-            t.join()
+    with ThreadPoolExecutor(max_workers=THREAD_COUNT) as pool:
+        for i in range(RUN_COUNT):
+            # Returns once every read of the run is done
+            list(pool.map(sqlite_reader, range(THREAD_COUNT), repeat(db), DATA[i]))
+            TOTAL += sum(RESULTS)
     print(f" Total {TOTAL}")
 
 
 def sqlite_reader2(t_index, params):
-    global TOTAL
     db = sqlite3.connect("benchr.db", check_same_thread=False)
-    res = db.execute(SQL_READ, (params[0], params[0] + params[1]))
-    res = res.fetchone()[0]
-    with LOCK:
-        if res is None:
-            res = 0
-        TOTAL += res
+    res = db.execute(SQL_READ, params)
+    RESULTS[t_index] = res.fetchone()[0] or 0
 
 
 def bench_threads2():
     global TOTAL
     TOTAL = 0
-    # reads from threads, one db handler per thread, minimal Lock
-    for i in range(RUN_COUNT):
-        threads = []
-        for t in range(THREAD_COUNT):
-            thread = threading.Thread(
-                target=sqlite_reader2,
-                args=(t, DATA[i][t]),
-            )
-            thread.daemon = True
-            thread.start()
-            threads.append(thread)
-        for t in threads:
-            t.join()
+    # reads from threads, one db handler per thread
+    with ThreadPoolExecutor(max_workers=THREAD_COUNT) as pool:
+        for i in range(RUN_COUNT):
+            list(pool.map(sqlite_reader2, range(THREAD_COUNT), DATA[i]))
+            TOTAL += sum(RESULTS)
     print(f" Total {TOTAL}")
 
 
 def sqlite_queuereader(t_index, db, params):
-    global TOTAL
-    res = db.fetchone(SQL_READ, (params[0], params[0] + params[1]))[0]
-    with LOCK:
-        if res is None:
-            res = 0
-        TOTAL += res
+    RESULTS[t_index] = db.fetchone(SQL_READ, params)[0] or 0
 
 
 def bench_queue(multi_db):
     global TOTAL
     TOTAL = 0
     # reads from threads, one single SqliteMulti
-    for i in range(RUN_COUNT):
-        threads = []
-        for t in range(THREAD_COUNT):
-            thread = threading.Thread(
-                target=sqlite_queuereader,
-                args=(t, multi_db, DATA[i][t]),
-            )
-            thread.daemon = True
-            thread.start()
-            threads.append(thread)
-        for t in threads:
-            t.join()
+    with ThreadPoolExecutor(max_workers=THREAD_COUNT) as pool:
+        for i in range(RUN_COUNT):
+            list(pool.map(sqlite_queuereader, range(THREAD_COUNT), repeat(multi_db), DATA[i]))
+            TOTAL += sum(RESULTS)
     print(f" Total {TOTAL}")
 
 
@@ -195,8 +158,6 @@ if __name__ == "__main__":
     start = time()
     bench_threads()
     total = time() - start
-    """Note that the lock (needed to calc TOTAL does not impact the speed. 
-    even without lock, even with no calc, timing is similar."""
     print(f"Direct, {THREAD_COUNT} threads sharing db: {total} s")
 
     start = time()
@@ -261,3 +222,20 @@ if __name__ == "__main__":
     print(f"SqliteMulti, Threads=16: {total} s")
     db.stop()
     db.join()
+
+    """One writer, several read only workers: reads fan out over their own connections, WAL lets them run alongside."""
+    db = SqliteMulti.connect("benchr.db", own_process=False, tasks=1, readers=4, verbose=False)
+    start = time()
+    bench_queue(db)
+    total = time() - start
+    print(f"SqliteMulti, Threads=1, Readers=4: {total} s")
+    db.stop()
+    db.join()
+
+    db = SqliteMulti.connect("benchr.db", own_process=True, tasks=1, readers=4, verbose=False)
+    start = time()
+    bench_queue(db)
+    total = time() - start
+    print(f"SqliteMulti, Processes=1, Readers=4: {total} s")
+    db.stop()
+    db.join()
@@ -114,7 +114,8 @@ def bench_queue(single_commits=True):
             if single_commits:
                 db.execute(SQL_INSERT, DATA[i][t], commit=True)
             else:
-                db.execute(SQL_INSERT, DATA[i][t], commit=False)
+                # No round trip: only the final commit() waits for the worker
+                db.execute_async(SQL_INSERT, DATA[i][t])
     if not single_commits:
         db.commit()
     db.stop()
@@ -131,7 +132,7 @@ def bench_queue_transaction():
     sql = [SQL_INSERT for i in range(THREAD_COUNT)]
     for i in range(RUN_COUNT):
         # sql and params both are lists
-        db.execute(sql, DATA[i], commit=True)
+        db.transaction(sql, DATA[i])
     db.stop()
     db.join()
 
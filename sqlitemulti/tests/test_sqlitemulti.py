@@ -8,9 +8,14 @@ execute all tests by running "pytest -v" in the test repo, or launch each .py to
 
 import pytest
 import os
+import re
+import sqlite3
 import sys
+from threading import Thread, Lock
+from time import perf_counter
 
 sys.path.append("../")
+from sqlitemulti import sqlitemulti
 from sqlitemulti.sqlitemulti import SqliteMulti
 
 
@@ -22,15 +27,22 @@ SQL_CREATE = (
 )
 
 
+def remove_db():
+    # With its WAL files: read only connections can't remove them, when they close last.
+    for name in ("test.db", "test.db-wal", "test.db-shm"):
+        if os.path.isfile(name):
+            os.remove(name)
+
+
 def test_connect_db():
-    if os.path.isfile("test.db"):
-        os.remove("test.db")
+    remove_db()
     db = SqliteMulti.connect("test.db")
+    db.stop()
+    db.join()
 
 
 def test_create_table():
-    if os.path.isfile("test.db"):
-        os.remove("test.db")
+    remove_db()
     db = SqliteMulti.connect("test.db")
     db.execute(SQL_CREATE, commit=True)  # Will do sql + commit
     # reread
@@ -39,11 +51,417 @@ def test_create_table():
         str(res)
         == "[(0, 'timestamp', 'TEXT', 0, None, 0), (1, 'address', 'TEXT', 0, None, 0), (2, 'recipient', 'TEXT', 0, None, 0), (3, 'amount', 'TEXT', 0, None, 0), (4, 'signature', 'TEXT', 0, None, 0), (5, 'public_key', 'TEXT', 0, None, 0), (6, 'operation', 'TEXT', 0, None, 0), (7, 'openfield', 'TEXT', 0, None, 0), (8, 'mergedts', 'INTEGER', 0, None, 0)]"
     )
+    db.stop()
+    db.join()
+
+
+def test_batched_inserts():
+    remove_db()
+    db = SqliteMulti.connect("test.db", max_batch=8)
+    db.execute(SQL_CREATE, commit=True)
+    sql = "INSERT INTO transactions (timestamp, amount) VALUES (?, ?)"
+
+    def writer(index):
+        for i in range(10):
+            db.insert(sql, (index, i))
+
+    threads = [Thread(target=writer, args=(index,)) for index in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Every insert was committed, whatever the batches were.
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (100,)
+    db.stop()
+    db.join()
+
+
+def test_own_process():
+    remove_db()
+    db = SqliteMulti.connect("test.db", own_process=True, tasks=2)
+    db.execute(SQL_CREATE, commit=True)
+    db.insert("INSERT INTO transactions (timestamp, amount) VALUES (?, ?)", (1, 2))
+    res = db.fetchall("SELECT timestamp, amount FROM transactions")
+    assert res == [("1", "2")]
+    # Can't be pickled: raises in the caller, instead of waiting forever for an answer
+    with pytest.raises(TypeError):
+        db.fetchone("SELECT ?", (Lock(),))
+    with db.pipeline() as pipe:
+        pipe.executemany("INSERT INTO transactions (timestamp, amount) VALUES (?, ?)", ((i, i) for i in range(3)))
+    assert pipe.results == [3]
+    db.stop()
+    db.join()
+
+
+def test_pragmas():
+    remove_db()
+    db = SqliteMulti.connect("test.db", pragmas={"cache_size": -1024})
+    assert db.fetchone("PRAGMA journal_mode") == ("wal",)
+    assert db.fetchone("PRAGMA cache_size") == (-1024,)
+    db.stop()
+    db.join()
+    db = SqliteMulti.connect("test.db", journal_mode="DELETE", synchronous="FULL")
+    assert db.fetchone("PRAGMA journal_mode") == ("delete",)
+    assert db.fetchone("PRAGMA synchronous") == (2,)
+    db.stop()
+    db.join()
+    # No WAL for in memory dbs
+    db = SqliteMulti.connect(":memory:")
+    assert db.fetchone("PRAGMA journal_mode") == ("memory",)
+    db.stop()
+    db.join()
+    # Read only connections can't see the writer's in memory db
+    with pytest.raises(ValueError):
+        SqliteMulti.connect(":memory:", readers=2)
+    with pytest.raises(ValueError):
+        SqliteMulti.connect("file::memory:", uri=True, read_only=True)
+
+
+@pytest.mark.parametrize("dispatch", ["rr", "sticky"])
+def test_fire_and_forget(dispatch):
+    remove_db()
+    db = SqliteMulti.connect("test.db", tasks=2, dispatch=dispatch)
+    db.execute(SQL_CREATE, commit=True)
+    sql = "INSERT INTO transactions (timestamp, amount) VALUES (?, ?)"
+    for i in range(20):
+        assert db.insert(sql, (i, i), commit=False) is None
+    for i in range(5):
+        assert db.execute_async(sql, (i, i)) is None
+    db.flush()
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (25,)
+    db.stop()
+    db.join()
+
+
+def test_transaction():
+    remove_db()
+    db = SqliteMulti.connect("test.db")
+    db.execute(SQL_CREATE, commit=True)
+    sql = "INSERT INTO transactions (timestamp, amount) VALUES (?, ?)"
+    assert db.execute([sql, sql], [(1, 1), (2, 2)]) == 2
+    # Second statement fails, whole transaction is rolled back
+    assert db.execute([sql, "INSERT INTO nowhere VALUES (?)"], [(3, 3), (4,)]) is False
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (2,)
+    # No params, runs as a script
+    assert db.execute(["DELETE FROM transactions", "DELETE FROM transactions"], [(), ()]) == 2
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (0,)
+    script = ["INSERT INTO transactions (timestamp) VALUES (1) -- c", "DELETE FROM transactions -- c"]
+    assert db.execute(script, [(), ()]) == 2
+    # transaction() answers None, or the exception that rolled it back
+    assert db.transaction([sql, sql], [(1, 1), (2, 2)]) is None
+    error = db.transaction([sql, "INSERT INTO nowhere VALUES (?)"], [(3, 3), (4,)])
+    assert isinstance(error, sqlite3.OperationalError)
+    assert db.transaction(["DELETE FROM transactions WHERE timestamp = 1"]) is None
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (1,)
+    db.stop()
+    db.join()
+
+
+def test_insertmany():
+    remove_db()
+    db = SqliteMulti.connect("test.db")
+    db.execute(SQL_CREATE, commit=True)
+    sql = "INSERT INTO transactions (timestamp, amount) VALUES (?, ?)"
+    assert db.insertmany(sql, ((i, i) for i in range(50))) == 50
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (50,)
+    assert db.executemany(sql, [(i, i) for i in range(5)]) == 5
+    db.stop()
+    db.join()
+
+
+def test_result_queues_freed():
+    remove_db()
+    db = SqliteMulti.connect("test.db")
+    threads = [Thread(target=db.fetchone, args=("SELECT 1",)) for index in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Ended threads do not keep their result queue
+    assert "0 result queues" in db.status()
+    # Answered: nothing pending anymore
+    db.fetchone("SELECT 1")
+    status = db.status()
+    assert "1 result queues" in status
+    assert "0 commands awaiting an answer" in status
+    db.stop()
+    db.join()
+
+
+@pytest.mark.parametrize("own_process", [False, True])
+def test_status_queued(own_process):
+    remove_db()
+    db = SqliteMulti.connect("test.db", own_process=own_process, timeout=10)
+    db.execute(SQL_CREATE, commit=True)
+    # The worker waits on that lock with the first insert, the others stay in the queue.
+    other = sqlite3.connect("test.db")
+    other.execute("BEGIN IMMEDIATE")
+    sql = "INSERT INTO transactions (timestamp, amount) VALUES (?, ?)"
+    for i in range(10):
+        db.execute_async(sql, (i, i))
+    queued = int(re.search(r"(\d+) commands queued", db.status()).group(1))
+    assert queued >= 9
+    other.rollback()
+    other.close()
+    db.flush()
+    assert "0 commands queued" in db.status()
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (10,)
+    db.stop()
+    db.join()
+
+
+def test_pipeline():
+    remove_db()
+    db = SqliteMulti.connect("test.db")
+    db.execute(SQL_CREATE, commit=True)
+    sql = "INSERT INTO transactions (timestamp, amount) VALUES (?, ?)"
+    with db.pipeline() as pipe:
+        pipe.insert(sql, (1, 1))
+        pipe.executemany(sql, [(2, 2), (3, 3)])
+        pipe.fetchone("SELECT COUNT(*) FROM transactions")
+    assert pipe.results == [True, 2, (3,)]
+    # Any failure rolls the whole pipeline back
+    with db.pipeline() as pipe:
+        pipe.insert(sql, (4, 4))
+        pipe.insert("INSERT INTO nowhere VALUES (?)", (5,))
+    assert pipe.results is False
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (3,)
+    # A list of sql would commit the ops before it: refused, and the block sends nothing.
+    with pytest.raises(TypeError):
+        with db.pipeline() as pipe:
+            pipe.insert(sql, (4, 4))
+            pipe.execute([sql, sql], [(5, 5), (6, 6)])
+    assert pipe.results is None
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (3,)
+    db.stop()
+    db.join()
+
+
+def test_read_only():
+    remove_db()
+    db = SqliteMulti.connect("test.db")
+    db.execute(SQL_CREATE, commit=True)
+    db.insert("INSERT INTO transactions (timestamp, amount) VALUES (?, ?)", (1, 2))
+    reader = SqliteMulti.connect("test.db", tasks=2, read_only=True)
+    assert reader.fetchall("SELECT timestamp, amount FROM transactions") == [("1", "2")]
+    assert reader.fetchone("SELECT COUNT(*) FROM transactions") == (1,)
+    with pytest.raises(ValueError):
+        reader.insert("INSERT INTO transactions (timestamp) VALUES (?)", (3,))
+    reader.stop()
+    reader.join()
+    db.stop()
+    db.join()
+
+
+@pytest.mark.parametrize("own_process", [False, True])
+def test_read_only_missing_db(own_process):
+    remove_db()
+    # A read only connection can't create the db: every command gets the error, none waits forever.
+    reader = SqliteMulti.connect("test.db", own_process=own_process, read_only=True)
+    for i in range(2):
+        with pytest.raises(sqlite3.OperationalError):
+            reader.fetchone("SELECT 1")
+    reader.stop()
+    reader.join()
+
+
+@pytest.mark.parametrize("own_process", [False, True])
+def test_readers_bad_path(own_process):
+    # The writer can't open the db: the constructor raises, and leaves no worker running.
+    with pytest.raises(sqlite3.OperationalError):
+        SqliteMulti.connect("/nonexistent_dir/test.db", own_process=own_process, readers=2)
+
+
+@pytest.mark.parametrize("own_process", [False, True])
+def test_readers(own_process):
+    remove_db()
+    db = SqliteMulti.connect("test.db", own_process=own_process, readers=2)
+    db.execute(SQL_CREATE, commit=True)
+    sql = "INSERT INTO transactions (timestamp, amount) VALUES (?, ?)"
+    db.insertmany(sql, [(i, i) for i in range(10)])
+    # Reads go to the read only workers, and see the committed inserts
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (10,)
+    assert len(db.fetchall("SELECT * FROM transactions")) == 10
+    db.stop()
+    db.join()
+
+
+def test_own_process_shared_memory(monkeypatch):
+    monkeypatch.setattr(sqlitemulti, "SHARED_MEMORY_ROWS", 100)
+    remove_db()
+    db = SqliteMulti.connect("test.db", own_process=True)
+    db.execute(SQL_CREATE, commit=True)
+    sql = "INSERT INTO transactions (timestamp, amount) VALUES (?, ?)"
+    # Small: through the pipe. Big: through shared memory.
+    assert db.insertmany(sql, [(i, i) for i in range(10)]) == 10
+    assert db.insertmany(sql, ((i, i) for i in range(1000))) == 1000
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (1010,)
+    # Pipelined ones, too
+    dumps = []
+    dump = sqlitemulti._SharedPayload.dump
+    monkeypatch.setattr(sqlitemulti._SharedPayload, "dump", lambda obj: dumps.append(len(obj)) or dump(obj))
+    with db.pipeline() as pipe:
+        pipe.executemany(sql, ((i, i) for i in range(1000)))
+        pipe.executemany(sql, [(i, i) for i in range(10)])
+    assert pipe.results == [1000, 10]
+    assert dumps == [1000]
+    # Refused before any shared memory block is created: nobody would free it.
+    reader = SqliteMulti.connect("test.db", own_process=True, read_only=True)
+
+    def dump(obj):
+        raise AssertionError("No block expected")
+
+    monkeypatch.setattr(sqlitemulti._SharedPayload, "dump", dump)
+    with pytest.raises(ValueError):
+        reader.insertmany(sql, [(i, i) for i in range(1000)])
+    reader.stop()
+    reader.join()
+    db.stop()
+    db.join()
+
+
+def test_own_process_dead_worker():
+    remove_db()
+    db = SqliteMulti.connect("test.db", own_process=True, timeout=10)
+    db.execute(SQL_CREATE, commit=True)
+    # The worker waits on that lock with the insert: its caller is waiting when the worker dies.
+    other = sqlite3.connect("test.db")
+    other.execute("BEGIN IMMEDIATE")
+    answers = []
+
+    def insert():
+        try:
+            db.execute("INSERT INTO transactions (timestamp) VALUES (1)", commit=True)
+        except RuntimeError as e:
+            answers.append(e)
+
+    thread = Thread(target=insert)
+    thread.start()
+    while "1 commands awaiting an answer" not in db.status():
+        pass
+    db._workers[0].kill()
+    thread.join()
+    assert len(answers) == 1
+    other.rollback()
+    other.close()
+    # Commands sent once it died are answered, too
+    with pytest.raises(RuntimeError):
+        db.fetchone("SELECT COUNT(*) FROM transactions")
+    with pytest.raises(RuntimeError):
+        db.flush()
+    db.stop()
+    db.join()
+
+
+@pytest.mark.parametrize("own_process", [False, True])
+def test_errors(own_process):
+    remove_db()
+    db = SqliteMulti.connect("test.db", own_process=own_process, readers=1)
+    db.execute(SQL_CREATE, commit=True)
+    # The caller gets the worker's exception, from the writer as well as from the readers
+    with pytest.raises(sqlite3.OperationalError):
+        db.execute("INSERT INTO nowhere VALUES (?)", (1,))
+    with pytest.raises(sqlite3.OperationalError):
+        db.fetchone("SELECT * FROM nowhere")
+    # Nobody waits for that one, it is only logged
+    db.execute_async("INSERT INTO nowhere VALUES (?)", (1,))
+    db.flush()
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (0,)
+    db.stop()
+    db.join()
+
+
+def test_batch_rolled_back():
+    remove_db()
+    db = SqliteMulti.connect("test.db")
+    db.execute("CREATE TABLE numbers (id INTEGER PRIMARY KEY)", commit=True)
+    db.stop()
+    db.join()
+    # Queued before the worker starts: the three of them run in the same batch.
+    queue = sqlitemulti.SimpleQueue()
+    answers = [sqlitemulti.SimpleQueue() for i in range(3)]
+    queue.put((answers[0], sqlitemulti.INSERT, "INSERT INTO numbers VALUES (?)", (1,), True))
+    queue.put((answers[1], sqlitemulti.INSERT, "INSERT INTO numbers VALUES (?)", (2,), True))
+    # Rolls the whole transaction back, the two inserts above with it
+    queue.put((answers[2], sqlitemulti.INSERT, "INSERT OR ROLLBACK INTO numbers VALUES (?)", (1,), True))
+    queue.put((None, sqlitemulti.STOP, "", (), False))
+    sqlitemulti.sqlite_worker(queue, "test.db", max_batch_delay=10)
+    for answer in answers:
+        assert isinstance(answer.get(), sqlite3.IntegrityError)
+    db = sqlite3.connect("test.db")
+    assert db.execute("SELECT COUNT(*) FROM numbers").fetchone() == (0,)
+    db.close()
+
+
+def test_retry_busy():
+    remove_db()
+    db = sqlite3.connect("test.db", timeout=0.1)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE t (a)")
+    db.commit()
+    other = sqlite3.connect("test.db", timeout=0.1)
+    # Stale snapshot: db reads, other writes, then db tries to write in the same transaction.
+    db.execute("BEGIN")
+    db.execute("SELECT * FROM t").fetchall()
+    other.execute("INSERT INTO t VALUES (1)")
+    other.commit()
+    cur = db.cursor()
+    with pytest.raises(sqlite3.OperationalError) as error:
+        sqlitemulti._h_execute(cur, "INSERT INTO t VALUES (?)", (2,))
+    assert sqlitemulti._is_busy(error.value)
+    # Rolled back, the retry writes on a fresh snapshot
+    res = sqlitemulti._retry_busy(
+        sqlitemulti._h_execute, cur, "INSERT INTO t VALUES (?)", (2,), error.value, perf_counter() + 1
+    )
+    assert res == (True, False)
+    db.commit()
+    assert db.execute("SELECT COUNT(*) FROM t").fetchone() == (2,)
+    # Locked for good: gives up at the deadline, and raises
+    other.execute("BEGIN IMMEDIATE")
+    with pytest.raises(sqlite3.OperationalError):
+        sqlitemulti._retry_busy(
+            sqlitemulti._h_execute, cur, "INSERT INTO t VALUES (?)", (3,), error.value, perf_counter() + 0.2
+        )
+    other.rollback()
+    db.close()
+    other.close()
+
+
+@pytest.mark.parametrize("readers", [0, 1])
+def test_own_process_shared_memory_fetchall(readers):
+    remove_db()
+    db = SqliteMulti.connect("test.db", own_process=True, readers=readers)
+    db.execute(SQL_CREATE, commit=True)
+    sql = "INSERT INTO transactions (timestamp, amount) VALUES (?, ?)"
+    rows = sqlitemulti.SHARED_MEMORY_ROWS
+    db.insertmany(sql, [(i, i) for i in range(rows)])
+    # Big enough for shared memory in the worker Process
+    res = db.fetchall("SELECT timestamp FROM transactions ORDER BY rowid")
+    assert len(res) == rows
+    assert res[-1] == (str(rows - 1),)
+    db.stop()
+    db.join()
+
+
+def test_own_process_sql_interning(monkeypatch):
+    monkeypatch.setattr(sqlitemulti, "MAX_INTERNED_SQL", 3)
+    remove_db()
+    db = SqliteMulti.connect("test.db", own_process=True, tasks=2)
+    db.execute(SQL_CREATE, commit=True)
+    sql = "INSERT INTO transactions (timestamp, amount) VALUES (?, ?)"
+    for i in range(10):
+        db.insert(sql, (i, i))
+    # Table full: sent as plain sql
+    for i in range(5):
+        assert db.fetchone(f"SELECT amount FROM transactions WHERE timestamp = {i}") == (str(i),)
+    assert db.fetchone("SELECT COUNT(*) FROM transactions") == (10,)
+    assert all(len(interns) <= 3 for interns in db._sql_interns.values())
+    db.stop()
+    db.join()
 
 
 if __name__ == "__main__":
-    if os.path.isfile("test.db"):
-        os.remove("test.db")
+    remove_db()
     db = SqliteMulti.connect("test.db", verbose=True)
     db.execute("PRAGMA journal_mode = WAL")
     db.execute(SQL_CREATE, commit=True)  # Will do sql + commit